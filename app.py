@@ -1,15 +1,25 @@
 import os
-from flask import Flask, redirect, request, render_template_string, session
+from flask import Flask, jsonify, redirect, request, session
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import urllib.parse
-from datetime import datetime, timezone, timedelta
+import orjson
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, wait as wait_futures
 import threading
 import time
 import base64
 import logging
+import pickle
 
 app = Flask(__name__)
-app.secret_key = os.environ.get('SECRET_KEY', os.urandom(24))
+# A random fallback key would invalidate every session on each restart,
+# forcing a full OAuth re-login stampede after every deploy — fail fast instead
+SECRET_KEY = os.environ.get('SECRET_KEY')
+if not SECRET_KEY:
+    raise RuntimeError("SECRET_KEY must be set")
+app.secret_key = SECRET_KEY
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -29,76 +39,221 @@ CLIENT_ID = os.environ.get('CLIENT_ID')
 CLIENT_SECRET = os.environ.get('CLIENT_SECRET')
 REDIRECT_URI = os.environ.get('REDIRECT_URI')
 
-# In-memory storage
-USERS = {}  # {character_id: {'character_name': str, 'portrait_url': str, 'access_token': str, 'refresh_token': str}}
-LOCATION_HISTORY = []  # [{'character_id': int, 'system_id': int, 'system_name': str, 'security_status': float, ...}]
+# Client credentials are process constants; build the token headers once
+# instead of re-encoding the Basic auth string on every token call
+_TOKEN_HEADERS = {
+    "Authorization": f"Basic {base64.b64encode(f'{CLIENT_ID}:{CLIENT_SECRET}'.encode()).decode()}",
+    "Content-Type": "application/x-www-form-urlencoded"
+}
+
+# Shared HTTP session so ESI/OAuth calls reuse pooled keep-alive connections
+# instead of paying a fresh TCP+TLS handshake per request
+SESSION = requests.Session()
+# Retries run inside the pooled connection (no new TLS handshake) and back
+# off exponentially; 429s honor ESI's Retry-After so we stop hammering it
+SESSION.mount("https://", HTTPAdapter(
+    pool_connections=4,
+    pool_maxsize=32,
+    max_retries=Retry(
+        total=5,
+        backoff_factor=0.3,
+        status_forcelist=(429, 500, 502, 503, 504),
+        allowed_methods=('GET', 'POST'),
+        respect_retry_after_header=True
+    )
+))
+SESSION.headers.update({"User-Agent": "TristarTech/1.0", "Accept": "application/json"})
+# Every call passes this timeout: a hung connection must fail instead of
+# pinning a poll worker (or a /callback request thread) forever
+REQUEST_TIMEOUT = 10
+
+# In-memory storage. Per-process state: run gunicorn with a single worker,
+# otherwise each worker keeps its own USERS/history and runs its own poller
+USERS = {}  # {character_id: {'character_name': str, 'portrait_url': str, 'access_token': str, 'refresh_token': str, 'expires_at': float}}
+# /callback and the poll workers mutate USERS concurrently; writers take this
+# lock and the poller snapshots under it once per cycle
+_USERS_LOCK = threading.Lock()
+# Per-character bounded history, keyed by system_id so dedup is a dict hit
+# instead of a scan; insertion order doubles as visit order. Memory stays
+# capped at HISTORY_MAXLEN x |USERS| instead of growing with total polls
+HISTORY_MAXLEN = 500
+HISTORY_TTL = 7 * 24 * 3600  # drop entries older than a week
+LOCATION_HISTORY = defaultdict(dict)  # {character_id: {system_id: entry}}
+_HISTORY_LOCK = threading.Lock()
 UPDATE_FREQUENCY = int(os.environ.get('UPDATE_FREQUENCY', 10))
+# Set by /update_settings to wake the poller so a new frequency applies
+# immediately instead of after the old interval elapses
+_SETTINGS_CHANGED = threading.Event()
+
+# Worker pool so the background loop polls users concurrently instead of serially
+POLL_POOL = ThreadPoolExecutor(max_workers=16)
+
+# System metadata is effectively immutable in EVE and portraits rarely
+# change, so cache both instead of re-fetching from ESI on every poll.
+# Entries expire after a day and revalidate via ETag; failures are not cached.
+SYSTEM_TTL = 86400
+_SYSTEM_CACHE = {}  # {system_id: (cached_at_monotonic, (system_name, security_status, is_wormhole))}
+# ESI sends strong ETags on /universe/systems/; remember them so a re-fetch
+# can be answered with a body-less 304 instead of a full JSON download
+_SYSTEM_ETAG = {}  # {system_id: (etag, (system_name, security_status, is_wormhole))}
+_SYSTEM_CACHE_LOCK = threading.Lock()
+_SYSTEM_PENDING = {}  # {system_id: Event set once an in-flight fetch finishes}
+# The system table is static, so persist it across restarts; a fresh process
+# starts with every previously-seen system already warm instead of refetching
+_SYSTEM_CACHE_FILE = os.environ.get('SYSTEM_CACHE_FILE', 'system_cache.pkl')
+_SYSTEM_SAVE_LOCK = threading.Lock()
+_PORTRAIT_CACHE = {}  # {character_id: portrait_url}
+
+# Shared empty user record so anonymous requests don't allocate a dict
+_EMPTY_USER = {}
+
+def _token_expiry(data):
+    # Absolute expiry with a 30s safety margin so we refresh before ESI 401s
+    return time.time() + data.get('expires_in', 1200) - 30
 
 def get_access_token(code):
     payload = {"grant_type": "authorization_code", "code": code}
-    auth_string = f"{CLIENT_ID}:{CLIENT_SECRET}"
-    headers = {
-        "Authorization": f"Basic {base64.b64encode(auth_string.encode()).decode()}",
-        "Content-Type": "application/x-www-form-urlencoded"
-    }
     try:
-        response = requests.post(TOKEN_URL, data=payload, headers=headers)
+        response = SESSION.post(TOKEN_URL, data=payload, headers=_TOKEN_HEADERS, timeout=REQUEST_TIMEOUT)
         response.raise_for_status()
-        data = response.json()
+        data = orjson.loads(response.content)
         logger.info(f"Access token retrieved for code: {code[:10]}...")
-        return data.get('access_token'), data.get('refresh_token')
-    except requests.RequestException as e:
+        return data.get('access_token'), data.get('refresh_token'), _token_expiry(data)
+    except (requests.RequestException, orjson.JSONDecodeError) as e:
         logger.error(f"Error getting access token: {e}")
-        return None, None
+        return None, None, None
 
 def refresh_access_token(refresh_token):
     payload = {"grant_type": "refresh_token", "refresh_token": refresh_token}
-    auth_string = f"{CLIENT_ID}:{CLIENT_SECRET}"
-    headers = {
-        "Authorization": f"Basic {base64.b64encode(auth_string.encode()).decode()}",
-        "Content-Type": "application/x-www-form-urlencoded"
-    }
     try:
-        response = requests.post(TOKEN_URL, data=payload, headers=headers)
+        response = SESSION.post(TOKEN_URL, data=payload, headers=_TOKEN_HEADERS, timeout=REQUEST_TIMEOUT)
         response.raise_for_status()
-        data = response.json()
+        data = orjson.loads(response.content)
         logger.info("Access token refreshed successfully")
-        return data.get('access_token'), data.get('refresh_token')
-    except requests.RequestException as e:
+        return data.get('access_token'), data.get('refresh_token'), _token_expiry(data)
+    except (requests.RequestException, orjson.JSONDecodeError) as e:
         logger.error(f"Error refreshing access token: {e}")
-        return None, None
+        return None, None, None
 
-def get_character_info(access_token):
+def verify_character(access_token):
     headers = {"Authorization": f"Bearer {access_token}"}
     try:
-        response = requests.get(VERIFY_URL, headers=headers)
+        response = SESSION.get(VERIFY_URL, headers=headers, timeout=REQUEST_TIMEOUT)
         response.raise_for_status()
-        char_data = response.json()
+        char_data = orjson.loads(response.content)
         character_id = char_data.get('CharacterID')
         character_name = char_data.get('CharacterName')
-        portrait_response = requests.get(PORTRAIT_URL.format(character_id=character_id))
-        portrait_response.raise_for_status()
-        portrait_url = portrait_response.json().get('px128x128', '')
-        logger.info(f"Character info retrieved for ID: {character_id}")
-        return character_id, character_name, portrait_url
-    except requests.RequestException as e:
-        logger.error(f"Error getting character info: {e}")
-        return None, None, None
+        logger.info(f"Character verified for ID: {character_id}")
+        return character_id, character_name
+    except (requests.RequestException, orjson.JSONDecodeError) as e:
+        logger.error(f"Error verifying character: {e}")
+        return None, None
 
-def get_system_info(system_id):
+def get_portrait_url(character_id):
+    portrait_url = _PORTRAIT_CACHE.get(character_id)
+    if portrait_url is not None:
+        return portrait_url
+    try:
+        response = SESSION.get(PORTRAIT_URL.format(character_id=character_id), timeout=REQUEST_TIMEOUT)
+        response.raise_for_status()
+        portrait_url = orjson.loads(response.content).get('px128x128', '')
+        _PORTRAIT_CACHE[character_id] = portrait_url
+        return portrait_url
+    except (requests.RequestException, orjson.JSONDecodeError) as e:
+        logger.error(f"Error getting portrait for character {character_id}: {e}")
+        return ''
+
+def _load_system_cache():
+    try:
+        with open(_SYSTEM_CACHE_FILE, 'rb') as f:
+            saved = pickle.load(f)
+        now = time.monotonic()
+        for system_id, (info, etag) in saved.items():
+            _SYSTEM_CACHE[system_id] = (now, info)
+            if etag:
+                _SYSTEM_ETAG[system_id] = (etag, info)
+    except FileNotFoundError:
+        return
+    except Exception as e:
+        # A corrupt or truncated cache file must never block boot;
+        # start cold and let the poller rebuild it
+        logger.error(f"Error loading system cache, starting cold: {e}")
+        _SYSTEM_CACHE.clear()
+        _SYSTEM_ETAG.clear()
+        return
+    logger.info(f"Loaded {len(saved)} systems from {_SYSTEM_CACHE_FILE}")
+
+def _save_system_cache():
+    # One writer at a time: concurrent pool workers share the tmp path, and
+    # interleaved dump/replace calls could publish a truncated file
+    with _SYSTEM_SAVE_LOCK:
+        with _SYSTEM_CACHE_LOCK:
+            saved = {system_id: (cached[1], _SYSTEM_ETAG.get(system_id, ('',))[0])
+                     for system_id, cached in _SYSTEM_CACHE.items()}
+        try:
+            tmp_path = _SYSTEM_CACHE_FILE + '.tmp'
+            with open(tmp_path, 'wb') as f:
+                pickle.dump(saved, f)
+            os.replace(tmp_path, _SYSTEM_CACHE_FILE)
+        except OSError as e:
+            logger.error(f"Error saving system cache: {e}")
+
+def _fetch_system_info(system_id):
     try:
-        response = requests.get(SYSTEM_URL.format(system_id=system_id))
+        headers = {}
+        etagged = _SYSTEM_ETAG.get(system_id)
+        if etagged:
+            headers['If-None-Match'] = etagged[0]
+        response = SESSION.get(SYSTEM_URL.format(system_id=system_id), headers=headers, timeout=REQUEST_TIMEOUT)
+        if response.status_code == 304:
+            info = etagged[1]
+            with _SYSTEM_CACHE_LOCK:
+                _SYSTEM_CACHE[system_id] = (time.monotonic(), info)
+            return info
         response.raise_for_status()
-        data = response.json()
+        data = orjson.loads(response.content)
         system_name = data.get('name', 'Unknown')
         security_status = round(data.get('security_status', 0.0), 1)
         is_wormhole = data.get('security_class') == 'W'
+        etag = response.headers.get('ETag')
+        with _SYSTEM_CACHE_LOCK:
+            _SYSTEM_CACHE[system_id] = (time.monotonic(), (system_name, security_status, is_wormhole))
+            if etag:
+                _SYSTEM_ETAG[system_id] = (etag, (system_name, security_status, is_wormhole))
+        _save_system_cache()
         logger.info(f"System info for ID {system_id}: {system_name}, Sec: {security_status}")
         return system_name, security_status, is_wormhole
-    except requests.RequestException as e:
+    except (requests.RequestException, orjson.JSONDecodeError) as e:
         logger.error(f"Error getting system info for ID {system_id}: {e}")
         return 'Unknown', 0.0, False
 
+def get_system_info(system_id):
+    cached = _SYSTEM_CACHE.get(system_id)
+    if cached is not None and time.monotonic() - cached[0] < SYSTEM_TTL:
+        return cached[1]
+    # Coalesce concurrent misses: when several poll workers land in the same
+    # unknown system in one tick, the first fetches and the rest wait for it.
+    # (ESI's bulk /universe/names route doesn't carry security data, so a
+    # true batched lookup isn't possible for this endpoint.)
+    with _SYSTEM_CACHE_LOCK:
+        cached = _SYSTEM_CACHE.get(system_id)
+        if cached is not None and time.monotonic() - cached[0] < SYSTEM_TTL:
+            return cached[1]
+        pending = _SYSTEM_PENDING.get(system_id)
+        if pending is None:
+            _SYSTEM_PENDING[system_id] = threading.Event()
+    if pending is not None:
+        pending.wait(timeout=10)
+        cached = _SYSTEM_CACHE.get(system_id)
+        return cached[1] if cached is not None else ('Unknown', 0.0, False)
+    try:
+        return _fetch_system_info(system_id)
+    finally:
+        with _SYSTEM_CACHE_LOCK:
+            event = _SYSTEM_PENDING.pop(system_id, None)
+        if event is not None:
+            event.set()
+
 def get_location(character_id, access_token):
     headers = {
         "Authorization": f"Bearer {access_token}",
@@ -106,11 +261,12 @@ def get_location(character_id, access_token):
         "X-Tenant": "tranquility"
     }
     try:
-        response = requests.get(LOCATION_URL.format(character_id=character_id), headers=headers)
+        response = SESSION.get(LOCATION_URL.format(character_id=character_id), headers=headers, timeout=REQUEST_TIMEOUT)
         response.raise_for_status()
-        data = response.json()
+        data = orjson.loads(response.content)
         system_id = data['solar_system_id']
         system_name, security_status, is_wormhole = get_system_info(system_id)
+        now = time.time()
         location = {
             'character_id': character_id,
             'system_id': system_id,
@@ -119,23 +275,69 @@ def get_location(character_id, access_token):
             'is_wormhole': is_wormhole,
             'station_id': data.get('station_id'),
             'structure_id': data.get('structure_id'),
-            'timestamp': datetime.now(timezone.utc)
+            # Stringify once at log time; age checks use the epoch int
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(now)),
+            'ts_epoch': int(now)
         }
         logger.info(f"Location retrieved for character {character_id}: {system_name}")
         return location
-    except requests.RequestException as e:
+    except (requests.RequestException, orjson.JSONDecodeError) as e:
         logger.error(f"Error getting location for character {character_id}: {e}")
         return None
 
+def _format_location(location):
+    return f"{location['system_name']} (ID: {location['system_id']}, Sec: {location['security_status']})" + (
+        f", Station ID: {location['station_id']}" if location['station_id'] else
+        f", Structure ID: {location['structure_id']}" if location['structure_id'] else ""
+    )
+
 def log_location(character_id, location):
     if location:
-        global LOCATION_HISTORY
-        LOCATION_HISTORY = [entry for entry in LOCATION_HISTORY if not (entry['character_id'] == character_id and entry['system_id'] == location['system_id'])]
-        LOCATION_HISTORY.append(location)
+        with _HISTORY_LOCK:
+            history = LOCATION_HISTORY[character_id]
+            # pop + reinsert moves a revisited system to the most-recent slot
+            history.pop(location['system_id'], None)
+            history[location['system_id']] = location
+            while len(history) > HISTORY_MAXLEN:
+                del history[next(iter(history))]
+            # Visit order doubles as time order, so expired entries sit at
+            # the front; stop at the first one still inside the TTL
+            cutoff = location['ts_epoch'] - HISTORY_TTL
+            while history:
+                oldest = next(iter(history.values()))
+                if oldest['ts_epoch'] >= cutoff:
+                    break
+                del history[oldest['system_id']]
+        # Keep the latest display string on the user record so home() reads
+        # it in O(1) and sees live updates from the poller
+        with _USERS_LOCK:
+            user = USERS.get(character_id)
+            if user is not None:
+                user['last_display'] = _format_location(location)
         logger.info(f"Logged location for character {character_id}: {location['system_name']}")
 
+# Wormhole entries age green -> yellow -> red over 24h/48h; k-space is blue
+_WH_COLORS = ('red', 'yellow', 'green')
+
+def _entry_color(entry, now_epoch):
+    if not entry['is_wormhole']:
+        return 'blue'
+    # The two threshold comparisons sum directly to the tuple index
+    age = now_epoch - entry['ts_epoch']
+    return _WH_COLORS[(age < 48 * 3600) + (age < 24 * 3600)]
+
 def get_location_history(character_id):
-    history = [
+    with _HISTORY_LOCK:
+        history = LOCATION_HISTORY.get(character_id)
+        entries = list(history.values()) if history else []
+    now_epoch = int(time.time())
+    # log_location only trims a character's history when it logs something
+    # new, so enforce the TTL here too or an idle character's stale rows
+    # would be served forever
+    cutoff = now_epoch - HISTORY_TTL
+    # Entries are kept in visit order (dedup reinserts), so newest-first
+    # is just a reverse walk — no sort needed
+    return [
         {
             'system_id': entry['system_id'],
             'system_name': entry['system_name'],
@@ -144,52 +346,83 @@ def get_location_history(character_id):
             'station_id': entry['station_id'],
             'structure_id': entry['structure_id'],
             'timestamp': entry['timestamp'],
-            'color': 'green' if entry['is_wormhole'] and (datetime.now(timezone.utc) - entry['timestamp']).total_seconds() < 24*3600 else
-                    'yellow' if entry['is_wormhole'] and (datetime.now(timezone.utc) - entry['timestamp']).total_seconds() < 48*3600 else
-                    'red' if entry['is_wormhole'] and (datetime.now(timezone.utc) - entry['timestamp']).total_seconds() >= 48*3600 else
-                    'blue'  # Non-wormhole default
-        } for entry in LOCATION_HISTORY if entry['character_id'] == character_id
+            'ts_epoch': entry['ts_epoch'],
+            'color': _entry_color(entry, now_epoch)
+        } for entry in reversed(entries) if entry['ts_epoch'] >= cutoff
     ]
-    return sorted(history, key=lambda x: x['timestamp'], reverse=True)
+
+def _refresh_user_token(character_id, refresh_token):
+    new_access_token, new_refresh_token, expires_at = refresh_access_token(refresh_token)
+    if not new_access_token:
+        # Don't keep polling a user we can no longer authenticate for
+        logger.error(f"Failed to refresh token for character {character_id}; removing user")
+        with _USERS_LOCK:
+            USERS.pop(character_id, None)
+        # Drop their history too, or characters we no longer poll would hold
+        # their HISTORY_MAXLEN entries for the life of the process
+        with _HISTORY_LOCK:
+            LOCATION_HISTORY.pop(character_id, None)
+        return None
+    with _USERS_LOCK:
+        user = USERS.get(character_id)
+        if user is not None:
+            user['access_token'] = new_access_token
+            user['refresh_token'] = new_refresh_token
+            user['expires_at'] = expires_at
+    logger.info(f"Token refreshed for character {character_id}")
+    return new_access_token
+
+def update_user_location(character_id):
+    user_data = USERS.get(character_id)
+    if user_data is None:
+        # Removed since the snapshot was taken
+        return
+    access_token = user_data.get('access_token')
+    refresh_token = user_data.get('refresh_token')
+    # Refresh proactively once the token is known-expired instead of burning
+    # a round-trip on a request that can only 401
+    if refresh_token and time.time() >= user_data.get('expires_at', 0):
+        access_token = _refresh_user_token(character_id, refresh_token)
+        if not access_token:
+            return
+    location = get_location(character_id, access_token)
+    if not location and refresh_token:
+        logger.info(f"Attempting to refresh token for character {character_id}")
+        access_token = _refresh_user_token(character_id, refresh_token)
+        if access_token:
+            location = get_location(character_id, access_token)
+    if location:
+        log_location(character_id, location)
 
 def background_location_update():
     while True:
-        for character_id, user_data in list(USERS.items()):
-            access_token = user_data.get('access_token')
-            refresh_token = user_data.get('refresh_token')
-            location = get_location(character_id, access_token)
-            if not location and refresh_token:
-                logger.info(f"Attempting to refresh token for character {character_id}")
-                new_access_token, new_refresh_token = refresh_access_token(refresh_token)
-                if new_access_token:
-                    USERS[character_id]['access_token'] = new_access_token
-                    USERS[character_id]['refresh_token'] = new_refresh_token
-                    logger.info(f"Token refreshed for character {character_id}")
-                    location = get_location(character_id, new_access_token)
-                else:
-                    logger.error(f"Failed to refresh token for character {character_id}")
-            if location:
-                log_location(character_id, location)
-                with app.app_context():
-                    session['location'] = f"{location['system_name']} (ID: {location['system_id']}, Sec: {location['security_status']})" + (
-                        f", Station ID: {location['station_id']}" if location['station_id'] else
-                        f", Structure ID: {location['structure_id']}" if location['structure_id'] else ""
-                    )
-        time.sleep(UPDATE_FREQUENCY)
+        # Deadline pacing: the cycle's work time comes out of the interval,
+        # so the effective period stays UPDATE_FREQUENCY instead of drifting
+        # to UPDATE_FREQUENCY + work
+        next_tick = time.monotonic() + UPDATE_FREQUENCY
+        # Snapshot ids before dispatch so /callback can't mutate USERS
+        # mid-iteration; workers resolve the live record themselves
+        with _USERS_LOCK:
+            snapshot = tuple(USERS)
+        futures = [POLL_POOL.submit(update_user_location, character_id)
+                   for character_id in snapshot]
+        # Bound the cycle so one stuck request can't stall polling indefinitely
+        done, not_done = wait_futures(futures, timeout=UPDATE_FREQUENCY)
+        if not_done:
+            logger.warning(f"{len(not_done)} location updates still pending at end of cycle")
+        for future in done:
+            error = future.exception()
+            if error:
+                logger.error(f"Error in location update worker: {error}")
+        sleep_for = next_tick - time.monotonic()
+        if sleep_for > 0 and _SETTINGS_CHANGED.wait(sleep_for):
+            _SETTINGS_CHANGED.clear()
 
 # Start background thread
+_load_system_cache()
 threading.Thread(target=background_location_update, daemon=True).start()
 
-@app.route('/')
-def home():
-    character_id = session.get('character_id')
-    character_name = USERS.get(character_id, {}).get('character_name') if character_id else None
-    portrait_url = USERS.get(character_id, {}).get('portrait_url') if character_id else None
-    location = session.get('location', None)
-    history = get_location_history(character_id) if character_id else []
-    update_frequency = UPDATE_FREQUENCY
-
-    html = """
+_HOME_HTML = """
     <!DOCTYPE html>
     <html>
     <head>
@@ -246,13 +479,7 @@ def home():
                 <div class="tab-pane fade" id="history" role="tabpanel">
                     <h3>Location History</h3>
                     <svg id="graph"></svg>
-                    <ul>
-                    {% for entry in history %}
-                    <li style="color: {{ entry.color }}">{{ entry.timestamp }}: {{ entry.system_name }} (ID: {{ entry.system_id }}, Sec: {{ entry.security_status }})
-                        {% if entry.station_id %}Station ID: {{ entry.station_id }}{% elif entry.structure_id %}Structure ID: {{ entry.structure_id }}{% endif %}
-                    </li>
-                    {% endfor %}
-                    </ul>
+                    <ul id="history-list"></ul>
                 </div>
                 <div class="tab-pane fade" id="settings" role="tabpanel">
                     <h3>Settings</h3>
@@ -277,76 +504,102 @@ def home():
                     console.error('Error initializing tabs:', e);
                 }
             });
-            // D3.js graph
-            const history = [
-                {% for entry in history %}
-                {
-                    system_id: {{ entry.system_id }},
-                    system_name: "{{ entry.system_name }}",
-                    security_status: {{ entry.security_status }},
-                    is_wormhole: {{ entry.is_wormhole | tojson }},
-                    timestamp: "{{ entry.timestamp.isoformat() }}",
-                    color: "{{ entry.color }}",
-                    is_current: {{ loop.first | tojson }}
-                },
-                {% endfor %}
-            ];
-            if (history.length > 0) {
-                const svg = d3.select("#graph")
-                    .attr("width", 600)
-                    .attr("height", 400);
-                const nodes = history.map((d, i) => ({
-                    id: d.system_id,
-                    name: `${d.system_name} (${d.security_status})`,
-                    color: d.color,
-                    is_current: d.is_current
-                }));
-                const links = [];
-                for (let i = 0; i < history.length - 1; i++) {
-                    links.push({
-                        source: history[i].system_id,
-                        target: history[i + 1].system_id
+            // History list + D3.js graph, rendered from /api/history so the
+            // page shell stays constant-size
+            function renderHistory(history) {
+                const list = document.getElementById('history-list');
+                for (const entry of history) {
+                    const li = document.createElement('li');
+                    li.style.color = entry.color;
+                    let text = `${entry.timestamp}: ${entry.system_name} (ID: ${entry.system_id}, Sec: ${entry.security_status})`;
+                    if (entry.station_id) {
+                        text += ` Station ID: ${entry.station_id}`;
+                    } else if (entry.structure_id) {
+                        text += ` Structure ID: ${entry.structure_id}`;
+                    }
+                    li.textContent = text;
+                    list.appendChild(li);
+                }
+                if (history.length > 0) {
+                    const svg = d3.select("#graph")
+                        .attr("width", 600)
+                        .attr("height", 400);
+                    const nodes = history.map((d, i) => ({
+                        id: d.system_id,
+                        name: `${d.system_name} (${d.security_status})`,
+                        color: d.color,
+                        is_current: i === 0
+                    }));
+                    const links = [];
+                    for (let i = 0; i < history.length - 1; i++) {
+                        links.push({
+                            source: history[i].system_id,
+                            target: history[i + 1].system_id
+                        });
+                    }
+                    const simulation = d3.forceSimulation(nodes)
+                        .force("link", d3.forceLink(links).id(d => d.id).distance(100))
+                        .force("charge", d3.forceManyBody().strength(-200))
+                        .force("center", d3.forceCenter(300, 200));
+                    const link = svg.append("g")
+                        .attr("class", "link")
+                        .selectAll("line")
+                        .data(links)
+                        .enter().append("line")
+                        .attr("stroke", "#999")
+                        .attr("stroke-opacity", 0.6);
+                    const node = svg.append("g")
+                        .attr("class", "node")
+                        .selectAll("g")
+                        .data(nodes)
+                        .enter().append("g")
+                        .attr("class", d => d.is_current ? "node current" : "node");
+                    node.append("circle")
+                        .attr("r", 8)
+                        .attr("fill", d => d.color);
+                    node.append("text")
+                        .attr("dx", 12)
+                        .attr("dy", ".35em")
+                        .text(d => d.name);
+                    simulation.on("tick", () => {
+                        link
+                            .attr("x1", d => d.source.x)
+                            .attr("y1", d => d.source.y)
+                            .attr("x2", d => d.target.x)
+                            .attr("y2", d => d.target.y);
+                        node
+                            .attr("transform", d => `translate(${d.x},${d.y})`);
                     });
                 }
-                const simulation = d3.forceSimulation(nodes)
-                    .force("link", d3.forceLink(links).id(d => d.id).distance(100))
-                    .force("charge", d3.forceManyBody().strength(-200))
-                    .force("center", d3.forceCenter(300, 200));
-                const link = svg.append("g")
-                    .attr("class", "link")
-                    .selectAll("line")
-                    .data(links)
-                    .enter().append("line")
-                    .attr("stroke", "#999")
-                    .attr("stroke-opacity", 0.6);
-                const node = svg.append("g")
-                    .attr("class", "node")
-                    .selectAll("g")
-                    .data(nodes)
-                    .enter().append("g")
-                    .attr("class", d => d.is_current ? "node current" : "node");
-                node.append("circle")
-                    .attr("r", 8)
-                    .attr("fill", d => d.color);
-                node.append("text")
-                    .attr("dx", 12)
-                    .attr("dy", ".35em")
-                    .text(d => d.name);
-                simulation.on("tick", () => {
-                    link
-                        .attr("x1", d => d.source.x)
-                        .attr("y1", d => d.source.y)
-                        .attr("x2", d => d.target.x)
-                        .attr("y2", d => d.target.y);
-                    node
-                        .attr("transform", d => `translate(${d.x},${d.y})`);
-                });
             }
+            fetch('/api/history').then((resp) => resp.json()).then(renderHistory);
         </script>
     </body>
     </html>
     """
-    return render_template_string(html, character_name=character_name, portrait_url=portrait_url, location=location, history=history, update_frequency=update_frequency)
+
+# Compiled once at import so requests skip Jinja lex/parse/compile
+_HOME_TEMPLATE = app.jinja_env.from_string(_HOME_HTML)
+
+@app.route('/')
+def home():
+    character_id = session.get('character_id')
+    user = (USERS.get(character_id) if character_id else None) or _EMPTY_USER
+    character_name = user.get('character_name')
+    portrait_url = user.get('portrait_url')
+    location = user.get('last_display')
+    update_frequency = UPDATE_FREQUENCY
+
+    return _HOME_TEMPLATE.render(character_name=character_name, portrait_url=portrait_url, location=location, update_frequency=update_frequency)
+
+@app.route('/api/history')
+def api_history():
+    character_id = session.get('character_id')
+    history = get_location_history(character_id) if character_id else []
+    response = jsonify(history)
+    # Short private TTL: the browser can reuse it across tab switches
+    response.headers['Cache-Control'] = 'private, max-age=5'
+    return response
 
 @app.route('/login')
 def login():
@@ -371,35 +624,38 @@ def callback():
         logger.error("No code received in callback")
         return "Error: No code received", 400
 
-    access_token, refresh_token = get_access_token(code)
+    access_token, refresh_token, expires_at = get_access_token(code)
     if not access_token:
         logger.error("Failed to get access token")
         return "Error getting access token", 400
 
-    character_id, character_name, portrait_url = get_character_info(access_token)
+    character_id, character_name = verify_character(access_token)
     if not character_id:
         logger.error("Failed to verify character")
         return "Error verifying character", 400
 
-    USERS[character_id] = {
-        'character_name': character_name,
-        'portrait_url': portrait_url,
-        'access_token': access_token,
-        'refresh_token': refresh_token
-    }
+    # Portrait and location are independent once the character is known;
+    # fetch the portrait on the pool while the location call runs
+    portrait_future = POLL_POOL.submit(get_portrait_url, character_id)
+    location = get_location(character_id, access_token)
+    portrait_url = portrait_future.result()
+
+    with _USERS_LOCK:
+        USERS[character_id] = {
+            'character_name': character_name,
+            'portrait_url': portrait_url,
+            'access_token': access_token,
+            'refresh_token': refresh_token,
+            'expires_at': expires_at
+        }
     logger.info(f"User authenticated: {character_name} (ID: {character_id})")
 
     session['character_id'] = character_id
     session['character_name'] = character_name
     session['portrait_url'] = portrait_url
 
-    location = get_location(character_id, access_token)
     if location:
         log_location(character_id, location)
-        session['location'] = f"{location['system_name']} (ID: {location['system_id']}, Sec: {location['security_status']})" + (
-            f", Station ID: {location['station_id']}" if location['station_id'] else
-            f", Structure ID: {location['structure_id']}" if location['structure_id'] else ""
-        )
     return redirect('/')
 
 @app.route('/update_settings', methods=['POST'])
@@ -409,6 +665,7 @@ def update_settings():
         UPDATE_FREQUENCY = int(request.form.get('update_frequency', 60))
         if UPDATE_FREQUENCY < 10:
             UPDATE_FREQUENCY = 10
+        _SETTINGS_CHANGED.set()
         logger.info(f"Update frequency set to {UPDATE_FREQUENCY} seconds")
     except ValueError:
         logger.error("Invalid update frequency input")